@@ -7,22 +7,48 @@ It is NOT used by the current deployed version.
 The main deployment uses Netlify Functions (netlify/functions/play.js).
 This FastAPI backend is provided for those who want to deploy on
 platforms like Render, Railway, or other Python-based hosting.
+
+Run with the uvloop event loop and httptools parser (both ship with
+uvicorn[standard]):
+
+    uvicorn main:app --loop uvloop --http httptools
+
+Nonces are sharded per process so that workers never hand out the same
+nonce. By default each process shards on its pid, which is unique among
+the processes running on one host, so uvicorn's --workers is safe. When
+running across several hosts, give every process a distinct WORKER_ID in
+[0, WORKER_COUNT) through its environment instead.
+
+Nonces are therefore not sequential. With the pid default, a process's
+n-th round uses nonce (n << 22) | pid, so consecutive nonces from one
+process jump by 2**22 and their low 22 bits expose the server pid.
+
+Requests with an out-of-range bet or multiplier, an unknown
+player_choice, or a missing field are rejected by FastAPI's request
+validation with status 422 and a body of the form
+{"detail": [{"loc": [...], "msg": "...", "type": "..."}, ...]}.
+A client_seed that cannot be encoded as UTF-8 (such as a lone surrogate)
+is rejected by /play with status 400.
 """
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, validator
-import hmac
-import hashlib
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from cachetools import TTLCache
+import itertools
+import os
 import time
-from collections import defaultdict
-from typing import Dict
+from collections import deque
+from typing import Annotated, Literal, Tuple
 import logging
 
+import pf_core
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -38,46 +64,51 @@ MIN_MULTIPLIER = 1.96
 MAX_MULTIPLIER = 10.00
 RTP = 0.98
 
-SERVER_SEED = "super_secret_server_seed_change_me"
-NONCE_COUNTER = 0
+# Linux caps pids at 2**22, so a pid always fits in the shard field.
+PID_SHARD_BITS = 22
+
+if "WORKER_ID" in os.environ:
+    WORKER_ID = int(os.environ["WORKER_ID"])
+    WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "1"))
+    if not 0 <= WORKER_ID < WORKER_COUNT:
+        raise ValueError(f"WORKER_ID must be in [0, {WORKER_COUNT}), got {WORKER_ID}")
+    _NONCE_SHARD_BITS = (WORKER_COUNT - 1).bit_length()
+else:
+    # uvicorn --workers starts every process with the same environment, so
+    # fall back to the pid, which no other live process on this host shares.
+    WORKER_ID = os.getpid()
+    _NONCE_SHARD_BITS = PID_SHARD_BITS
+    if WORKER_ID >> _NONCE_SHARD_BITS:
+        raise RuntimeError(
+            f"pid {WORKER_ID} does not fit in {PID_SHARD_BITS} bits; "
+            "set WORKER_ID and WORKER_COUNT explicitly"
+        )
+
+# Worker W issues nonces (local << _NONCE_SHARD_BITS) | W, so shards are
+# disjoint without any cross-process coordination. next() on
+# itertools.count is a single C-level step, so concurrent requests within
+# a worker can never observe the same local counter.
+_nonce_counter = itertools.count(1)
 
 RATE_LIMIT_WINDOW = 2
 RATE_LIMIT_MAX_REQUESTS = 5
+RATE_LIMIT_MAX_CLIENTS = 100_000
 
-rate_limit_store: Dict[str, list] = defaultdict(list)
+# Idle clients expire on their own; the entry is re-set on every accepted
+# request so an active client's window history is never dropped early.
+rate_limit_store: TTLCache = TTLCache(
+    maxsize=RATE_LIMIT_MAX_CLIENTS, ttl=RATE_LIMIT_WINDOW * 2
+)
 
 class PlayRequest(BaseModel):
-    bet: float
-    multiplier: float
+    bet: Annotated[float, Field(ge=MIN_BET, le=MAX_BET)]
+    multiplier: Annotated[float, Field(ge=MIN_MULTIPLIER, le=MAX_MULTIPLIER)]
     client_seed: str
-    player_choice: str = "heads"
-
-    @validator('bet')
-    def validate_bet(cls, v):
-        if not isinstance(v, (int, float)):
-            raise ValueError('Bet must be a number')
-        if v < MIN_BET:
-            raise ValueError(f'Bet must be at least ${MIN_BET}')
-        if v > MAX_BET:
-            raise ValueError(f'Bet cannot exceed ${MAX_BET}')
-        return float(v)
-
-    @validator('multiplier')
-    def validate_multiplier(cls, v):
-        if not isinstance(v, (int, float)):
-            raise ValueError('Multiplier must be a number')
-        if v < MIN_MULTIPLIER:
-            raise ValueError(f'Multiplier must be at least {MIN_MULTIPLIER}')
-        if v > MAX_MULTIPLIER:
-            raise ValueError(f'Multiplier cannot exceed {MAX_MULTIPLIER}')
-        return float(v)
-
-    @validator('player_choice')
-    def validate_choice(cls, v):
-        if v not in ["heads", "tails"]:
-            raise ValueError('Player choice must be "heads" or "tails"')
-        return v
+    player_choice: Literal["heads", "tails"] = "heads"
 
+# Response models document the API schema only. Handlers return
+# ORJSONResponse directly, which FastAPI sends without revalidating or
+# running jsonable_encoder over the payload.
 class PlayResponse(BaseModel):
     did_win: bool
     roll_won: bool
@@ -96,101 +127,79 @@ def get_client_identifier(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 def check_rate_limit(client_id: str) -> bool:
-    now = time.time()
-    requests = rate_limit_store[client_id]
+    now = time.monotonic()
+    requests = rate_limit_store.get(client_id)
+    if requests is None:
+        requests = deque()
     
-    requests[:] = [req_time for req_time in requests if now - req_time < RATE_LIMIT_WINDOW]
+    while requests and now - requests[0] >= RATE_LIMIT_WINDOW:
+        requests.popleft()
     
     if len(requests) >= RATE_LIMIT_MAX_REQUESTS:
         return False
     
     requests.append(now)
+    rate_limit_store[client_id] = requests
     return True
 
-def get_server_seed_hash(server_seed: str) -> str:
-    return hashlib.sha256(server_seed.encode()).hexdigest()
-
-def generate_random_0_1(server_seed: str, client_seed: str, nonce: int) -> float:
-    message = f"{client_seed}:{nonce}".encode()
-    digest = hmac.new(server_seed.encode(), message, hashlib.sha256).hexdigest()
-    first_8_bytes = digest[:16]
-    as_int = int(first_8_bytes, 16)
-    max_int = 16 ** 16
-    return as_int / max_int
+def generate_random_0_1(client_seed: str, nonce: int) -> Tuple[float, bytes]:
+    digest = pf_core.hmac_digest(client_seed, nonce)
+    return pf_core.digest_to_float(digest), digest
 
 @app.post("/play", response_model=PlayResponse)
 async def play(req: PlayRequest, request: Request):
-    global NONCE_COUNTER
-    
     try:
         client_id = get_client_identifier(request)
         
         if not check_rate_limit(client_id):
-            logger.warning(f"Rate limit exceeded for client {client_id}")
+            logger.warning("Rate limit exceeded for client %s", client_id)
             raise HTTPException(
                 status_code=429,
                 detail="Too many requests. Please slow down."
             )
         
-        if req.bet < MIN_BET or req.bet > MAX_BET:
-            logger.warning(
-                f"Out-of-range bet attempt: {req.bet} from {client_id}"
-            )
-            raise HTTPException(
-                status_code=400,
-                detail=f"Bet must be between ${MIN_BET} and ${MAX_BET}"
-            )
-        
-        if req.multiplier < MIN_MULTIPLIER or req.multiplier > MAX_MULTIPLIER:
-            logger.warning(
-                f"Out-of-range multiplier attempt: {req.multiplier} from {client_id}"
-            )
-            raise HTTPException(
-                status_code=400,
-                detail=f"Multiplier must be between {MIN_MULTIPLIER} and {MAX_MULTIPLIER}"
-            )
-        
-        NONCE_COUNTER += 1
-        nonce = NONCE_COUNTER
+        nonce = (next(_nonce_counter) << _NONCE_SHARD_BITS) | WORKER_ID
         
         win_chance = RTP / req.multiplier
         
-        roll = generate_random_0_1(SERVER_SEED, req.client_seed, nonce)
+        roll, digest = generate_random_0_1(req.client_seed, nonce)
         
         did_win = roll < win_chance
-        coin_side = "heads" if roll < 0.5 else "tails"
+        coin_side = pf_core.digest_to_coin_side(digest)
         
         choice_matched = coin_side == req.player_choice
         actual_win = did_win and choice_matched
         
         payout = req.bet * req.multiplier if actual_win else 0.0
         
-        server_seed_hash = get_server_seed_hash(SERVER_SEED)
-        
-        logger.info(
-            f"Game round: client={client_id}, bet={req.bet}, mult={req.multiplier}, "
-            f"win={actual_win}, nonce={nonce}"
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Game round: client=%s, bet=%s, mult=%s, win=%s, nonce=%s",
+                client_id, req.bet, req.multiplier, actual_win, nonce,
+            )
         
-        return PlayResponse(
-            did_win=actual_win,
-            roll_won=did_win,
-            choice_matched=choice_matched,
-            payout=payout,
-            roll=roll,
-            win_chance=win_chance,
-            server_seed_hash=server_seed_hash,
-            nonce=nonce,
-            coin_side=coin_side,
-        )
+        return ORJSONResponse({
+            "did_win": actual_win,
+            "roll_won": did_win,
+            "choice_matched": choice_matched,
+            "payout": payout,
+            "roll": roll,
+            "win_chance": win_chance,
+            "server_seed_hash": pf_core.SERVER_SEED_HASH,
+            "nonce": nonce,
+            "coin_side": coin_side,
+        })
     
     except HTTPException:
         raise
-    except ValueError as e:
-        logger.error(f"Validation error: {str(e)} from {get_client_identifier(request)}")
-        raise HTTPException(status_code=400, detail=str(e))
+    except UnicodeEncodeError:
+        logger.warning("Non-UTF-8 client_seed from %s", get_client_identifier(request))
+        raise HTTPException(
+            status_code=400,
+            detail="client_seed must be valid UTF-8"
+        )
     except Exception as e:
-        logger.error(f"Unexpected error in /play: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in /play: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="An unexpected error occurred. Please try again."
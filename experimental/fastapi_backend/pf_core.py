@@ -0,0 +1,65 @@
+"""
+PROVABLY FAIR CORE
+
+HMAC-SHA256(server_seed, "client_seed:nonce") and the helpers that turn
+its digest into game outcomes. The FastAPI app (main.py) is a thin layer
+over this module, so every optimization to the roll path lives here.
+
+rotate_seed(), hmac_uint64() and digest_to_u64() are public API for a
+future seed reveal/verification path and are not called by main.py yet.
+"""
+
+import hashlib
+import secrets
+import struct
+from typing import Optional, Tuple
+
+SERVER_SEED = "super_secret_server_seed_change_me"
+SERVER_SEED_BYTES = SERVER_SEED.encode()
+SERVER_SEED_HASH = hashlib.sha256(SERVER_SEED_BYTES).hexdigest()
+
+def build_hmac_contexts(key: bytes) -> Tuple["hashlib._Hash", "hashlib._Hash"]:
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key.ljust(64, b"\x00")
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+    outer = hashlib.sha256(bytes(b ^ 0x5C for b in key))
+    return inner, outer
+
+# HMAC-SHA256 key schedule, absorbed once so each roll skips the two
+# key-padding compressions. rotate_seed() rebuilds these.
+_HMAC_INNER, _HMAC_OUTER = build_hmac_contexts(SERVER_SEED_BYTES)
+
+_INV_2_64 = 1.0 / float(1 << 64)
+
+def rotate_seed(new_seed: Optional[str] = None) -> str:
+    """Switch to a new server seed and return the previous one."""
+    global SERVER_SEED, SERVER_SEED_BYTES, SERVER_SEED_HASH
+    global _HMAC_INNER, _HMAC_OUTER
+
+    previous = SERVER_SEED
+    SERVER_SEED = new_seed if new_seed is not None else secrets.token_hex(32)
+    SERVER_SEED_BYTES = SERVER_SEED.encode()
+    SERVER_SEED_HASH = hashlib.sha256(SERVER_SEED_BYTES).hexdigest()
+    _HMAC_INNER, _HMAC_OUTER = build_hmac_contexts(SERVER_SEED_BYTES)
+    return previous
+
+def hmac_digest(client_seed: str, nonce: int) -> bytes:
+    inner = _HMAC_INNER.copy()
+    inner.update(b"%b:%d" % (client_seed.encode(), nonce))
+    outer = _HMAC_OUTER.copy()
+    outer.update(inner.digest())
+    return outer.digest()
+
+def digest_to_u64(digest: bytes) -> int:
+    return struct.unpack_from(">Q", digest)[0]
+
+def digest_to_float(digest: bytes) -> float:
+    return struct.unpack_from(">Q", digest)[0] * _INV_2_64
+
+def digest_to_coin_side(digest: bytes) -> str:
+    # Top bit of the roll's uint64: same outcome as roll < 0.5
+    return "tails" if digest[0] & 0x80 else "heads"
+
+def hmac_uint64(client_seed: str, nonce: int) -> int:
+    return digest_to_u64(hmac_digest(client_seed, nonce))